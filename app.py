@@ -1,22 +1,54 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request
+from flask_compress import Compress
 from ibm_watson import NaturalLanguageUnderstandingV1
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from ibm_watson.natural_language_understanding_v1 import Features, KeywordsOptions, CategoriesOptions, SentimentOptions
 import os
+import re
 from dotenv import load_dotenv
+from ibm_cloud_sdk_core.http_adapter import SSLHTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from cloudant.client import Cloudant
-from datetime import datetime
+from semantic_cache import initialize_semantic_cache
+from collections import OrderedDict
+import hashlib
 import json
+import orjson
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging - records are handed to a queue and written by a background listener
+log_queue = queue.Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 500
+app.config['COMPRESS_LEVEL'] = 6
+Compress(app)
+
+ANALYZE_FEATURES = Features(
+    sentiment=SentimentOptions(),
+    categories=CategoriesOptions(limit=3),
+    keywords=KeywordsOptions(limit=5)
+)
+
+def _json(obj, status=200):
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
 
 def validate_config():
     required_vars = ['NLU_APIKEY', 'NLU_URL']
@@ -25,6 +57,17 @@ def validate_config():
         raise ValueError(f"Missing required environment variables: {missing_vars}")
     logger.info("Configuration validated successfully")
 
+def configure_http_pool(nlu):
+    # Widen the pool of the SDK's own session so concurrent requests reuse
+    # kept-alive connections. SSLHTTPAdapter keeps the SDK's TLS 1.2+ floor.
+    # Analyze calls are billed POSTs: retry connection failures and gateway errors,
+    # but never a read timeout, and let the last error response reach the SDK so
+    # it raises its usual ApiException.
+    retry = Retry(total=3, connect=2, read=0, backoff_factor=0.3,
+                  status_forcelist=[502, 503, 504], allowed_methods=None, raise_on_status=False)
+    adapter = SSLHTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+    nlu.http_client.mount('https://', adapter)
+
 def initialize_watson_nlu():
     try:
         validate_config()
@@ -34,10 +77,11 @@ def initialize_watson_nlu():
             authenticator=authenticator
         )
         nlu.set_service_url(os.getenv('NLU_URL'))
+        configure_http_pool(nlu)
         logger.info("Watson NLU initialized successfully")
         return nlu
     except Exception as e:
-        logger.error(f"Failed to initialize Watson NLU: {str(e)}")
+        logger.error("Failed to initialize Watson NLU: %s", e)
         raise
 
 def initialize_cloudant():
@@ -48,10 +92,10 @@ def initialize_cloudant():
         db_name = os.getenv('CLOUDANT_DB')
 
         logger.info("Cloudant config check:")
-        logger.info(f"  Username: {'SET' if cloudant_user else 'NOT SET'}")
-        logger.info(f"  API Key: {'SET' if cloudant_api_key else 'NOT SET'}")
-        logger.info(f"  URL: {'SET' if cloudant_url else 'NOT SET'}")
-        logger.info(f"  DB Name: {db_name if db_name else 'NOT SET'}")
+        logger.info("  Username: %s", 'SET' if cloudant_user else 'NOT SET')
+        logger.info("  API Key: %s", 'SET' if cloudant_api_key else 'NOT SET')
+        logger.info("  URL: %s", 'SET' if cloudant_url else 'NOT SET')
+        logger.info("  DB Name: %s", db_name if db_name else 'NOT SET')
 
         if not all([cloudant_user, cloudant_api_key, cloudant_url, db_name]):
             logger.warning("Missing Cloudant credentials - database storage disabled")
@@ -59,33 +103,146 @@ def initialize_cloudant():
 
         client = Cloudant.iam(cloudant_user, cloudant_api_key, connect=True, url=cloudant_url)
         session = client.session()
-        logger.info(f"Cloudant session established: {session}")
+        logger.info("Cloudant session established: %s", session)
 
         if db_name in client.all_dbs():
             db = client[db_name]
-            logger.info(f"Connected to existing database: {db_name}")
+            logger.info("Connected to existing database: %s", db_name)
         else:
-            db = client.create_database(db_name)
-            logger.info(f"Created new database: {db_name}")
+            # Every gunicorn worker runs this at startup, so another one may
+            # create the database first; that 412 is not a failure
+            try:
+                db = client.create_database(db_name, throw_on_exists=False)
+                logger.info("Created new database: %s", db_name)
+            except Exception:
+                if db_name not in client.all_dbs():
+                    raise
+                db = client[db_name]
+                logger.info("Connected to database created by another worker: %s", db_name)
 
         return client, db
     except Exception as e:
-        logger.error(f"Cloudant initialization failed: {str(e)}")
-        logger.error(f"Error type: {type(e).__name__}")
+        logger.error("Cloudant initialization failed: %s", e)
+        logger.error("Error type: %s", type(e).__name__)
         return None, None
 
 # Initialize services
 try:
     nlu = initialize_watson_nlu()
 except Exception as e:
-    logger.error(f"Application startup failed: {str(e)}")
+    logger.error("Application startup failed: %s", e)
     nlu = None
 
 cloudant_client, cloudant_db = initialize_cloudant()
 
+# Cloudant writes are drained by a background thread so they stay off the request path
+STORAGE_FLUSH_INTERVAL = 0.5
+STORAGE_BATCH_SIZE = 100
+STORAGE_DRAIN_TIMEOUT = 5
+storage_queue = queue.Queue()
+
+def storage_worker():
+    while True:
+        documents = [storage_queue.get()]
+        deadline = time.monotonic() + STORAGE_FLUSH_INTERVAL
+        while len(documents) < STORAGE_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                documents.append(storage_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        try:
+            results = cloudant_db.bulk_docs(documents)
+            failed = [r for r in results if 'error' in r]
+            if failed:
+                logger.error("Failed to store %d of %d documents in Cloudant: %s", len(failed), len(documents), failed)
+            else:
+                logger.info("Stored %d documents in Cloudant", len(documents))
+        except Exception as ce:
+            logger.error("Failed to store analysis in Cloudant: %s", ce)
+            logger.error("Error type: %s", type(ce).__name__)
+        finally:
+            for _ in documents:
+                storage_queue.task_done()
+
+def store_analysis(document):
+    if cloudant_db is None:
+        logger.warning("Cloudant database not available - skipping storage")
+        return
+    storage_queue.put(document)
+
+def drain_storage_queue(timeout=STORAGE_DRAIN_TIMEOUT):
+    # Bounded wait: bulk_docs has no request timeout and may hang if Cloudant is down
+    deadline = time.monotonic() + timeout
+    while storage_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if storage_queue.unfinished_tasks:
+        logger.error("Dropping %d documents not stored in Cloudant before shutdown", storage_queue.unfinished_tasks)
+
+if cloudant_db is not None:
+    threading.Thread(target=storage_worker, name='cloudant-storage', daemon=True).start()
+    atexit.register(drain_storage_queue)
+
+# Exact-match cache of NLU responses, keyed by a hash of the input text
+ENABLE_ANALYZE_CACHE = os.getenv('ENABLE_ANALYZE_CACHE', 'true').lower() in ('1', 'true', 'yes')
+ANALYZE_CACHE_TTL = int(os.getenv('ANALYZE_CACHE_TTL', 86400))
+ANALYZE_CACHE_MAXSIZE = int(os.getenv('ANALYZE_CACHE_MAXSIZE', 4096))
+ANALYZE_FEATURES_KEY = 'sentiment|categories:3|keywords:5'
+
+analyze_cache = OrderedDict()
+analyze_cache_lock = threading.Lock()
+
+def analyze_cache_key(text):
+    # BLAKE2b is cheaper than SHA-256 and a 128-bit digest is plenty for a cache key
+    return hashlib.blake2b(f"{ANALYZE_FEATURES_KEY}\n{text}".encode(), digest_size=16).hexdigest()
+
+def analyze_cache_get(key):
+    if not ENABLE_ANALYZE_CACHE:
+        return None
+    with analyze_cache_lock:
+        entry = analyze_cache.get(key)
+        if entry is None:
+            return None
+        stored_at, response = entry
+        if time.monotonic() - stored_at > ANALYZE_CACHE_TTL:
+            del analyze_cache[key]
+            return None
+        analyze_cache.move_to_end(key)
+        return response
+
+def analyze_cache_put(key, response, age=0):
+    if not ENABLE_ANALYZE_CACHE:
+        return
+    with analyze_cache_lock:
+        analyze_cache[key] = (time.monotonic() - age, response)
+        analyze_cache.move_to_end(key)
+        while len(analyze_cache) > ANALYZE_CACHE_MAXSIZE:
+            analyze_cache.popitem(last=False)
+
+ANALYZE_BATCH_LIMIT = 100
+ANALYZE_BATCH_WORKERS = 8
+
+# Near-duplicate cache of NLU responses, matched by embedding similarity
+semantic_cache = initialize_semantic_cache(ttl=ANALYZE_CACHE_TTL)
+if semantic_cache is not None:
+    atexit.register(semantic_cache.save)
+
+# index.html takes no context, so render it once and serve the bytes
+with app.app_context():
+    INDEX_HTML = render_template('index.html').encode()
+INDEX_ETAG = hashlib.md5(INDEX_HTML).hexdigest()
+
 @app.route('/')
 def home():
-    return render_template('index.html')
+    if app.debug:
+        return render_template('index.html')
+    response = app.response_class(INDEX_HTML, mimetype='text/html')
+    response.set_etag(INDEX_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
 
 @app.route('/health')
 def health_check():
@@ -94,8 +251,8 @@ def health_check():
         'cloudant': 'healthy' if cloudant_db is not None else 'unavailable'
     }
     if nlu is None:
-        return jsonify({'status': 'error', 'message': 'Watson NLU not initialized', 'services': status}), 503
-    return jsonify({'status': 'healthy', 'service': 'news-classifier', 'services': status})
+        return _json({'status': 'error', 'message': 'Watson NLU not initialized', 'services': status}, 503)
+    return _json({'status': 'healthy', 'service': 'news-classifier', 'services': status})
 
 @app.route('/test-cloudant', methods=['POST'])
 def test_cloudant():
@@ -103,118 +260,256 @@ def test_cloudant():
         try:
             test_doc = {
                 'test': True,
-                'timestamp': datetime.utcnow().isoformat(),
+                'timestamp_ns': time.time_ns(),
                 'message': 'This is a test document'
             }
             result = cloudant_db.create_document(test_doc)
-            logger.info(f"Test document created: {result}")
-            all_docs = cloudant_db.all_docs()
-            doc_count = len(all_docs['rows'])
-            return jsonify({
+            logger.info("Test document created: %s", result)
+            doc_count = cloudant_db.doc_count()
+            return _json({
                 'success': True,
                 'document_id': result['_id'],
                 'total_documents': doc_count,
                 'message': 'Test document created successfully'
             })
         except Exception as e:
-            logger.error(f"Cloudant test failed: {str(e)}")
-            return jsonify({'error': f'Cloudant test failed: {str(e)}'}), 500
+            logger.error("Cloudant test failed: %s", e)
+            return _json({'error': f'Cloudant test failed: {str(e)}'}, 500)
+    else:
+        return _json({'error': 'Cloudant not initialized'}, 503)
+
+# ASCII control characters other than tab, newline and carriage return
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def prepare_text(text):
+    text = (text or '').strip()
+    if not text:
+        return None, 'No text provided for analysis'
+    if len(text) < 15:
+        return None, 'Text too short for meaningful analysis (minimum 15 characters)'
+    if CONTROL_CHARS.search(text):
+        return None, 'Text contains unsupported control characters'
+    if len(text) > 50000:
+        text = text[:50000]
+        logger.warning("Text truncated to 50,000 characters")
+    return text, None
+
+def lookup_cached_analysis(text):
+    """Return (cache_key, semantic_vec, cached_response) for the given text."""
+    cache_key = analyze_cache_key(text)
+    cached = analyze_cache_get(cache_key)
+    if cached is not None:
+        logger.info("Returning cached analysis - skipping Watson NLU and Cloudant")
+        return cache_key, None, cached
+
+    semantic_vec = None
+    if semantic_cache is not None:
+        semantic_vec = semantic_cache.encode(text)
+        similar = semantic_cache.get(semantic_vec)
+        if similar is not None:
+            response, age = similar
+            cached = {**response, 'cache': 'semantic'}
+            # Keep the original age so the exact cache does not extend its TTL
+            analyze_cache_put(cache_key, cached, age=age)
+            return cache_key, semantic_vec, cached
+
+    return cache_key, semantic_vec, None
+
+def run_analysis(text):
+    """Call Watson NLU and return the raw JSON body of its response."""
+    logger.info("Analyzing text of length: %d", len(text))
+    # stream=True makes the SDK hand back the requests.Response unparsed
+    content = nlu.analyze(
+        text=text,
+        features=ANALYZE_FEATURES,
+        stream=True
+    ).get_result().content
+    logger.info("Analysis completed successfully")
+    return content
+
+def remember_analysis(cache_key, semantic_vec, response):
+    analyze_cache_put(cache_key, response)
+    if semantic_vec is not None:
+        semantic_cache.put(semantic_vec, response)
+
+# Concurrent requests for the same text share one Watson call (single-flight)
+class InflightAnalysis:
+    # No attributes on the Event itself: gevent's patched Event has __slots__
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+inflight_analyses = {}
+inflight_lock = threading.Lock()
+
+def analyze_and_store(text, cache_key, semantic_vec):
+    """Return (raw JSON bytes, parsed response) for a fresh Watson analysis."""
+    with inflight_lock:
+        flight = inflight_analyses.get(cache_key)
+        leader = flight is None
+        if leader:
+            flight = InflightAnalysis()
+            inflight_analyses[cache_key] = flight
+
+    if not leader:
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        logger.info("Reusing analysis from a concurrent identical request")
+        return flight.result
+
+    try:
+        # A previous leader may have finished between the caller's cache lookup and now
+        cached = analyze_cache_get(cache_key)
+        if cached is not None:
+            flight.result = (orjson.dumps(cached), cached)
+            return flight.result
+        content = run_analysis(text)
+        response = orjson.loads(content)
+        remember_analysis(cache_key, semantic_vec, response)
+        store_analysis(build_document(text, response))
+        flight.result = (content, response)
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        # Only requests already waiting share this result; later ones start afresh
+        with inflight_lock:
+            inflight_analyses.pop(cache_key, None)
+        flight.event.set()
+
+def build_document(text, response):
+    return {
+        "timestamp_ns": time.time_ns(),
+        "input_text": text[:1000],
+        "input_text_length": len(text),
+        "analysis_result": response
+    }
+
+def describe_analysis_error(error_msg):
+    """Map a Watson NLU error message to a (client message, HTTP status) pair."""
+    if "unauthorized" in error_msg.lower():
+        return 'Invalid API credentials. Check your Watson NLU API key.', 401
+    elif "not enough text" in error_msg.lower():
+        return 'Not enough text for analysis. Please provide more content.', 400
+    elif "quota" in error_msg.lower() or "limit" in error_msg.lower():
+        return 'API usage limit reached. Try again later.', 429
     else:
-        return jsonify({'error': 'Cloudant not initialized'}), 503
+        return f'Analysis failed: {error_msg}', 500
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     if nlu is None:
-        return jsonify({'error': 'Watson NLU service not available. Check your configuration.'}), 503
+        return _json({'error': 'Watson NLU service not available. Check your configuration.'}, 503)
 
     try:
-        text = request.form.get('news', '').strip()
-        if not text:
-            return jsonify({'error': 'No text provided for analysis'}), 400
-        if len(text) < 15:
-            return jsonify({'error': 'Text too short for meaningful analysis (minimum 15 characters)'}), 400
-        if len(text) > 50000:
-            text = text[:50000]
-            logger.warning("Text truncated to 50,000 characters")
-
-        logger.info(f"Analyzing text of length: {len(text)}")
-
-        response = nlu.analyze(
-            text=text,
-            features=Features(
-                sentiment=SentimentOptions(),
-                categories=CategoriesOptions(limit=3),
-                keywords=KeywordsOptions(limit=5)
-            )
-        ).get_result()
-
-        logger.info("Analysis completed successfully")
-
-        if cloudant_db is not None:
-            try:
-                document = {
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "input_text": text[:1000],
-                    "input_text_length": len(text),
-                    "analysis_result": response
-                }
-                logger.info("Attempting to store document in Cloudant...")
-                result = cloudant_db.create_document(document)
-                if result.exists():
-                    logger.info(f"Document successfully stored with ID: {result['_id']}")
-                else:
-                    logger.error("Document creation returned success but document doesn't exist")
-            except Exception as ce:
-                logger.error(f"Failed to store analysis in Cloudant: {str(ce)}")
-                logger.error(f"Error type: {type(ce).__name__}")
-        else:
-            logger.warning("Cloudant database not available - skipping storage")
+        text, error = prepare_text(request.form.get('news', ''))
+        if error:
+            return _json({'error': error}, 400)
+
+        cache_key, semantic_vec, cached = lookup_cached_analysis(text)
+        if cached is not None:
+            return _json(cached)
 
-        return jsonify(response)
+        content, _ = analyze_and_store(text, cache_key, semantic_vec)
+
+        # Fresh results are passed through as Watson's bytes, without re-encoding
+        return app.response_class(content, mimetype='application/json')
 
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Analysis failed: {error_msg}")
-        if "unauthorized" in error_msg.lower():
-            return jsonify({'error': 'Invalid API credentials. Check your Watson NLU API key.'}), 401
-        elif "not enough text" in error_msg.lower():
-            return jsonify({'error': 'Not enough text for analysis. Please provide more content.'}), 400
-        elif "quota" in error_msg.lower() or "limit" in error_msg.lower():
-            return jsonify({'error': 'API usage limit reached. Try again later.'}), 429
+        logger.error("Analysis failed: %s", error_msg)
+        message, status = describe_analysis_error(error_msg)
+        return _json({'error': message}, status)
+
+@app.route('/analyze_batch', methods=['POST'])
+def analyze_batch():
+    if nlu is None:
+        return _json({'error': 'Watson NLU service not available. Check your configuration.'}, 503)
+
+    payload = request.get_json(silent=True) or {}
+    texts = payload if isinstance(payload, list) else payload.get('texts') if isinstance(payload, dict) else None
+    if not isinstance(texts, list) or not texts:
+        return _json({'error': 'Request body must be a non-empty JSON array of texts or an object with a "texts" array'}, 400)
+    if len(texts) > ANALYZE_BATCH_LIMIT:
+        return _json({'error': f'Too many texts in batch (maximum {ANALYZE_BATCH_LIMIT})'}, 400)
+
+    results = [None] * len(texts)
+    pending = []
+    for i, raw in enumerate(texts):
+        text, error = prepare_text(raw if isinstance(raw, str) else '')
+        if error:
+            results[i] = {'error': error}
+            continue
+        try:
+            cache_key, semantic_vec, cached = lookup_cached_analysis(text)
+        except Exception as e:
+            logger.error("Cache lookup failed: %s", e)
+            cache_key, semantic_vec, cached = analyze_cache_key(text), None, None
+        if cached is not None:
+            results[i] = cached
         else:
-            return jsonify({'error': f'Analysis failed: {error_msg}'}), 500
+            pending.append((i, text, cache_key, semantic_vec))
+
+    def analyze_one(item):
+        i, text, cache_key, semantic_vec = item
+        try:
+            _, response = analyze_and_store(text, cache_key, semantic_vec)
+            return response
+        except Exception as e:
+            logger.error("Analysis failed: %s", e)
+            message, _ = describe_analysis_error(str(e))
+            return {'error': message}
+
+    if pending:
+        logger.info("Dispatching %d of %d texts to Watson NLU", len(pending), len(texts))
+        with ThreadPoolExecutor(max_workers=ANALYZE_BATCH_WORKERS) as executor:
+            for (i, *_), result in zip(pending, executor.map(analyze_one, pending)):
+                results[i] = result
+
+    return _json({'results': results})
 
 @app.route('/db-status')
 def db_status():
     if cloudant_db is not None:
         try:
-            doc_count = len(cloudant_db)
-            recent_docs = [doc['_id'] for doc in cloudant_db if '_id' in doc][-5:]
-            return jsonify({
+            doc_count = cloudant_db.doc_count()
+            result = cloudant_db.all_docs(limit=5, descending=True, include_docs=False)
+            recent_docs = [row['id'] for row in result['rows']]
+            return _json({
                 'database_name': cloudant_db.database_name,
                 'document_count': doc_count,
                 'recent_documents': recent_docs
             })
         except Exception as e:
-            logger.error(f"Failed to get database status: {str(e)}")
-            return jsonify({'error': f'Database status check failed: {str(e)}'}), 500
+            logger.error("Failed to get database status: %s", e)
+            return _json({'error': f'Database status check failed: {str(e)}'}, 500)
     else:
-        return jsonify({'error': 'Cloudant not initialized'}), 503
+        return _json({'error': 'Cloudant not initialized'}, 503)
 
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({'error': 'Endpoint not found'}), 404
+    return _json({'error': 'Endpoint not found'}, 404)
 
 @app.errorhandler(405)
 def method_not_allowed(error):
-    return jsonify({'error': 'Method not allowed'}), 405
+    return _json({'error': 'Method not allowed'}, 405)
 
 @app.errorhandler(500)
 def internal_error(error):
-    logger.error(f"Internal server error: {str(error)}")
-    return jsonify({'error': 'Internal server error'}), 500
+    logger.error("Internal server error: %s", error)
+    return _json({'error': 'Internal server error'}, 500)
 
 if __name__ == '__main__':
+    if os.getenv('FLASK_ENV') != 'development':
+        print("The Flask debug server only runs with FLASK_ENV=development. For production use:")
+        print("    gunicorn -c gunicorn_conf.py app:app")
+        exit(1)
+
     if nlu is None:
         print("ERROR: Cannot start application - Watson NLU initialization failed")
         exit(1)
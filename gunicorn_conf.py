@@ -0,0 +1,13 @@
+import multiprocessing
+import os
+
+# Watson NLU calls are I/O-bound, so gevent workers multiplex many in-flight
+# requests per process. State in app.py is per worker, not shared: the exact
+# cache, the single-flight table that merges concurrent identical calls, the
+# semantic cache and its embedding model, and the Cloudant storage queue.
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gevent'
+worker_connections = 1000
+keepalive = 30
+timeout = 60
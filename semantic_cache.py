@@ -0,0 +1,164 @@
+import os
+import json
+import tempfile
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import faiss
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    faiss = None
+    np = None
+    SentenceTransformer = None
+
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+EMBEDDING_DIM = 384
+SEARCH_DEPTH = 8
+
+class SemanticCache:
+    """Near-duplicate cache of NLU responses, matched by embedding cosine similarity."""
+
+    def __init__(self, threshold=0.90, path=None, maxsize=10000, ttl=86400):
+        self.threshold = threshold
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.model = SentenceTransformer(EMBEDDING_MODEL)
+        self.index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        # (stored_at, response) pairs in insertion order, parallel to the index.
+        # Wall-clock time so ages survive a save/load across restarts.
+        self.entries = []
+        self.lock = threading.Lock()
+        self.writer_lock = None
+        if path:
+            self.load()
+            self.acquire_writer_lock()
+
+    def encode(self, text):
+        vec = self.model.encode([text], normalize_embeddings=True)
+        return np.asarray(vec, dtype='float32')
+
+    def get(self, vec):
+        """Return (response, age in seconds) of the closest live entry, or None."""
+        with self.lock:
+            if self.index.ntotal == 0:
+                return None
+            # Look past the top hit so an expired entry cannot shadow a fresh
+            # one stored for the same text after it expired
+            scores, ids = self.index.search(vec, min(self.index.ntotal, SEARCH_DEPTH))
+            now = time.time()
+            for score, idx in zip(scores[0], ids[0]):
+                if idx < 0 or score < self.threshold:
+                    return None
+                stored_at, response = self.entries[idx]
+                age = now - stored_at
+                if age <= self.ttl:
+                    break
+            else:
+                return None
+        logger.info("Semantic cache hit (similarity %.3f)", score)
+        return response, age
+
+    def put(self, vec, response):
+        with self.lock:
+            if self.index.ntotal >= self.maxsize:
+                self.evict()
+            self.index.add(vec)
+            self.entries.append((time.time(), response))
+
+    def evict(self):
+        # IndexFlatIP cannot drop rows cheaply, so rebuild it without expired
+        # entries and the oldest tenth of the rest. Caller holds self.lock.
+        now = time.time()
+        keep = [i for i, (stored_at, _) in enumerate(self.entries) if now - stored_at <= self.ttl]
+        overflow = len(keep) - (self.maxsize - max(1, self.maxsize // 10))
+        if overflow > 0:
+            keep = keep[overflow:]
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        if keep:
+            index.add(vectors[keep])
+        logger.info("Evicted %d semantic cache entries", len(self.entries) - len(keep))
+        self.index = index
+        self.entries = [self.entries[i] for i in keep]
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                index = faiss.deserialize_index(data['index'])
+                entries = [tuple(e) for e in json.loads(data['entries'].tobytes())]
+            if index.ntotal != len(entries):
+                logger.warning("Semantic cache on disk is inconsistent - starting empty")
+                return
+            self.index, self.entries = index, entries
+            logger.info("Loaded %d semantic cache entries from %s", len(entries), self.path)
+        except Exception as e:
+            logger.error("Failed to load semantic cache: %s", e)
+
+    def acquire_writer_lock(self):
+        # With several gunicorn workers sharing the path, only one of them saves
+        try:
+            import fcntl
+        except ImportError:
+            logger.warning("fcntl not available - semantic cache will not be saved")
+            return
+        try:
+            lock_file = open(f"{self.path}.lock", 'w')
+        except OSError as e:
+            logger.error("Cannot open semantic cache lock file - saving disabled: %s", e)
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            logger.info("Another worker owns %s - semantic cache will not be saved from this one", self.path)
+            return
+        self.writer_lock = lock_file
+
+    def save(self):
+        # Index and entries go into one file that is swapped in atomically, so
+        # a reader never sees a mismatched pair on disk.
+        if self.writer_lock is None:
+            return
+        try:
+            with self.lock:
+                index_bytes = faiss.serialize_index(self.index)
+                entries_bytes = np.frombuffer(json.dumps(self.entries).encode(), dtype='uint8')
+                count = len(self.entries)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, index=index_bytes, entries=entries_bytes)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            logger.info("Saved %d semantic cache entries to %s", count, self.path)
+        except Exception as e:
+            logger.error("Failed to save semantic cache: %s", e)
+
+def initialize_semantic_cache(ttl=86400):
+    if os.getenv('ENABLE_SEMANTIC_CACHE', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    if SentenceTransformer is None:
+        logger.warning("faiss/sentence-transformers not installed - semantic cache disabled")
+        return None
+    try:
+        cache = SemanticCache(
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.90)),
+            path=os.getenv('SEMANTIC_CACHE_PATH'),
+            maxsize=int(os.getenv('SEMANTIC_CACHE_MAXSIZE', 10000)),
+            ttl=ttl
+        )
+        logger.info("Semantic cache initialized successfully")
+        return cache
+    except Exception as e:
+        logger.error("Semantic cache initialization failed: %s", e)
+        return None